@@ -15,6 +15,12 @@
 # limitations under the License.
 #
 
+# importing time to log cold start time
+import time
+# time instance started loading this module
+start_time = time.time()
+# importing logging to log cold start time
+import logging
 # importing webapp2 framework for google app engine
 import webapp2
 # importing jinja 2 for template rendering
@@ -25,6 +31,8 @@ import os
 from google.appengine.api import users
 # importing ndb for querying datastore
 from google.appengine.ext import ndb
+# importing memcache to share compiled templates between instances
+from google.appengine.api import memcache
 # importing blobstore_handler for upload blog files in this case image
 from google.appengine.ext.webapp import blobstore_handlers
 # importing blobstore for blog key
@@ -34,9 +42,25 @@ import json
 # importing datetime for post/comment creation
 import datetime
 
-# jinja template environment with autoescape html entities
+
+# same loader as in Activity 2/taskmanagement/main.py, apps are deployed separately and can't share a module
+class CompiledTemplateLoader(jinja2.ChoiceLoader):
+    def load(self, environment, name, globals=None):
+        for loader in self.loaders:
+            try:
+                return loader.load(environment, name, globals)
+            except jinja2.TemplateNotFound:
+                pass
+        raise jinja2.TemplateNotFound(name)
+
+
+# jinja template environment with autoescape html entities, templates precompiled by compile_templates.py
 jinja = jinja2.Environment(
-    loader=jinja2.FileSystemLoader(os.path.dirname(__file__)),
+    loader=CompiledTemplateLoader([
+        jinja2.ModuleLoader(os.path.join(os.path.dirname(__file__), 'templates_compiled')),
+        jinja2.FileSystemLoader(os.path.dirname(__file__))
+    ]),
+    bytecode_cache=jinja2.MemcachedBytecodeCache(memcache.Client()),
     extensions=['jinja2.ext.autoescape'],
     autoescape=True
 )
@@ -402,3 +426,6 @@ app = webapp2.WSGIApplication([
     (r'/comment', CommentHandler),
     (r'/post/(\d+)', PostHandler),
 ], debug=True)
+
+# logging time taken by new instance to load this module
+logging.info('insta instance started in %.1f ms', (time.time() - start_time) * 1000)
@@ -0,0 +1,378 @@
+#!/usr/bin/env python
+#
+# Load and datastore RPC budget harness for the taskmanagement app.
+# Runs the app in process on App Engine testbed stubs through webtest, with generated users, taskboards,
+# invited users and tasks, and concurrent editors saving and updating tasks on the same taskboard.
+# Prints latency percentiles, datastore RPCs and transaction retries of every route, and exits with
+# status 1 if a request made more datastore RPCs than the budget declared for its route, if any request
+# failed with a 5xx status, or if more requests of a route were refused than its error budget allows.
+#
+# needs python 2.7 with the App Engine python SDK and webtest (pip install webtest)
+#
+# usage: python loadtest.py --sdk path/to/google_appengine [--users 200 --boards 50 --tasks 500 ...]
+from __future__ import print_function
+
+import argparse
+import collections
+import datetime
+import os
+import random
+import sys
+import threading
+import time
+import urllib
+
+# directory of taskmanagement app
+APP_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'taskmanagement')
+
+# rows returned by one datastore query batch when no batch size is given.
+# RunQuery and every Next of the SDK's datastore stub return up to 300 rows
+QUERY_BATCH = 300
+
+# datastore RPC budget of every route, as
+# (fixed RPCs, RPCs per query batch of rows the request reads, RPCs per failed transaction attempt).
+# rows are tasks, users or taskboards listed by the request, so reading them in batches stays within budget
+# while one get per row goes over it.
+# set from counts observed on the SDK's stubs, where gets answered from ndb's memcache make no RPC
+RPC_BUDGETS = {
+    '/': (7, 2, 0),
+    '/viewtb': (2, 1, 0),
+    '/viewtb (304)': (1, 0, 0),
+    '/invite': (2, 1, 0),
+    '/invite (post)': (8, 0, 5),
+    '/invite (uninvite)': (11, 1, 5),
+    '/addtask': (1, 1, 0),
+    '/addtask (save)': (8, 0, 5),
+    '/addtask (update)': (9, 0, 7),
+    '/deletetb': (7, 0, 5),
+}
+
+
+# share of requests of a route allowed to be refused with a 4xx status, e.g 409 when all attempts of a
+# transaction failed under concurrent edits. routes not listed refuse none, a 5xx is never allowed
+ERROR_BUDGETS = {
+    '/addtask (save)': 0.05,
+    '/addtask (update)': 0.1,
+}
+
+
+# number of query batches needed to read given number of rows
+def batches(rows):
+    return rows // QUERY_BATCH + 1
+
+
+# RPC budget of a request to route reading given rows and retrying given transactions
+def budget(route, rows, retries):
+    fixed, per_batch, per_retry = RPC_BUDGETS[route]
+    return fixed + per_batch * batches(rows) + per_retry * retries
+
+
+# os.environ replacement keeping a separate environment for every thread,
+# as App Engine does for every request, so concurrent editors can be logged in as different users
+class ThreadEnviron(collections.MutableMapping):
+    def __init__(self, environ):
+        self._shared = dict(environ)
+        self._local = threading.local()
+        # thread creating it uses the shared environment, other threads start from a copy of it
+        self._local.environ = self._shared
+
+    def _environ(self):
+        if not hasattr(self._local, 'environ'):
+            self._local.environ = dict(self._shared)
+        return self._local.environ
+
+    def __getitem__(self, key):
+        return self._environ()[key]
+
+    def __setitem__(self, key, value):
+        self._environ()[key] = value
+
+    def __delitem__(self, key):
+        del self._environ()[key]
+
+    def __iter__(self):
+        return iter(self._environ())
+
+    def __len__(self):
+        return len(self._environ())
+
+
+# datastore RPCs and failed commits of requests made by current thread
+rpc_counts = threading.local()
+
+
+def reset_rpc_counts():
+    rpc_counts.calls = collections.Counter()
+    rpc_counts.retries = 0
+
+
+# apiproxy hook counting every datastore call
+def count_call(service, call, request, response):
+    if hasattr(rpc_counts, 'calls'):
+        rpc_counts.calls[call] += 1
+
+
+# apiproxy hook counting transaction attempts failed by concurrent transactions, on commit or on a read,
+# which ndb or the app try again
+def count_retry(service, call, request, response, rpc, error):
+    if error is not None and call in ('Commit', 'Get', 'RunQuery') and hasattr(rpc_counts, 'calls'):
+        rpc_counts.retries += 1
+
+
+# measured requests, appended from all threads
+class Results(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = collections.defaultdict(list)
+
+    def add(self, route, latency, rpcs, retries, rows, status):
+        with self.lock:
+            self.requests[route].append((latency, rpcs, retries, rows, status))
+
+    # print table of all routes, returns failures as route and what failed
+    def report(self):
+        failures = []
+        print('%-20s %6s %6s %6s %9s %9s %9s %8s %8s %8s %8s' % (
+            'route', 'count', 'errors', '4xx', 'p50 ms', 'p90 ms', 'p99 ms', 'rpc avg', 'rpc max', 'budget',
+            'retries'))
+        for route in sorted(self.requests):
+            requests = self.requests[route]
+            latencies = sorted(request[0] for request in requests)
+            budgets = [budget(route, request[3], request[2]) for request in requests]
+            exceeded = [request for request, request_budget in zip(requests, budgets) if request[1] > request_budget]
+            errors = len([request for request in requests if request[4] >= 500])
+            refused = len([request for request in requests if 400 <= request[4] < 500])
+            route_failures = []
+            if exceeded:
+                route_failures.append('over RPC budget')
+            if errors:
+                route_failures.append('%d server errors' % errors)
+            if refused > ERROR_BUDGETS.get(route, 0) * len(requests):
+                route_failures.append('%d refused, over error budget' % refused)
+            print('%-20s %6d %6d %6d %9.1f %9.1f %9.1f %8.1f %8d %8d %8d%s' % (
+                route, len(requests), errors, refused,
+                percentile(latencies, 50), percentile(latencies, 90), percentile(latencies, 99),
+                sum(request[1] for request in requests) / float(len(requests)),
+                max(request[1] for request in requests), max(budgets),
+                sum(request[2] for request in requests), '  FAILED' if route_failures else ''))
+            failures.extend('%s: %s' % (route, failure) for failure in route_failures)
+        return failures
+
+
+def percentile(values, percent):
+    return values[min(len(values) - 1, int(len(values) * percent / 100.0))]
+
+
+class Harness(object):
+    def __init__(self, options):
+        self.options = options
+        self.results = Results()
+        self.random = random.Random(options.seed)
+
+        # App Engine SDK on path, stubs for services used by app
+        sys.path.insert(0, options.sdk)
+        import dev_appserver
+        dev_appserver.fix_sys_path()
+        os.environ = ThreadEnviron(os.environ)
+        from google.appengine.api import apiproxy_stub_map
+        from google.appengine.datastore import datastore_stub_util
+        from google.appengine.ext import testbed
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_datastore_v3_stub(
+            consistency_policy=datastore_stub_util.PseudoRandomHRConsistencyPolicy(probability=1))
+        self.testbed.init_memcache_stub()
+        self.testbed.init_user_stub()
+        self.testbed.init_taskqueue_stub(root_path=APP_DIR)
+        self.taskqueue_stub = self.testbed.get_stub(testbed.TASKQUEUE_SERVICE_NAME)
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append('loadtest_calls', count_call, 'datastore_v3')
+        apiproxy_stub_map.apiproxy.GetPostCallHooks().Append('loadtest_retries', count_retry, 'datastore_v3')
+
+        # app loaded after stubs are in place
+        sys.path.insert(0, APP_DIR)
+        import main
+        import webtest
+        self.main = main
+        self.app = webtest.TestApp(main.app)
+
+    # log in current thread as given user
+    def login(self, user, admin=False):
+        os.environ['USER_EMAIL'] = user.email
+        os.environ['USER_ID'] = str(user.key.id())
+        os.environ['USER_IS_ADMIN'] = '1' if admin else '0'
+        os.environ['AUTH_DOMAIN'] = 'gmail.com'
+
+    # make request, recording its latency and datastore RPCs under route
+    # rows is the number of rows the request reads, for its RPC budget
+    def request(self, route, method, url, params=None, rows=0, headers=None):
+        reset_rpc_counts()
+        # ndb caches entities in context of a request, start every request with empty cache
+        self.main.ndb.get_context().clear_cache()
+        start = time.time()
+        if method == 'GET':
+            response = self.app.get(url, params, headers=headers, expect_errors=True)
+        else:
+            response = self.app.post(url, params, headers=headers, expect_errors=True)
+        latency = (time.time() - start) * 1000
+        self.results.add(route, latency, sum(rpc_counts.calls.values()), rpc_counts.retries, rows,
+                         response.status_int)
+        return response
+
+    # run all jobs added to task queue, and jobs those jobs add, as admin
+    def run_queued_jobs(self):
+        while True:
+            jobs = self.taskqueue_stub.get_filtered_tasks()
+            if not jobs:
+                return
+            self.taskqueue_stub.FlushQueue('default')
+            for job in jobs:
+                self.app.post(job.url, job.payload, extra_environ={'USER_IS_ADMIN': '1'},
+                              headers={'Content-Type': 'application/x-www-form-urlencoded'})
+
+    # users, taskboards, invited users and tasks, written directly in batches
+    def generate(self):
+        main = self.main
+        options = self.options
+        print('generating %d users, %d taskboards with %d users and %d tasks each' % (
+            options.users, options.boards, options.members, options.tasks))
+        self.users = [main.User(email='user%d@example.com' % number) for number in range(options.users)]
+        main.ndb.put_multi(self.users)
+        self.boards = []
+        self.members = {}
+        for number in range(options.boards):
+            creator = self.random.choice(self.users)
+            board = main.Taskboard(title='board %d' % number, creator=creator.key, creator_email=creator.email,
+                                   version=options.tasks)
+            board.put()
+            members = self.random.sample([user for user in self.users if user.key != creator.key],
+                                         min(options.members, len(self.users) - 1))
+            main.ndb.put_multi([
+                main.TaskboardUser(key=main.membership_key(board.key, member.key), taskboard=board.key,
+                                   user=member.key)
+                for member in members
+            ])
+            self.boards.append(board)
+            self.members[board.key] = [creator] + members
+            tasks = []
+            for task_number in range(options.tasks):
+                assigned = self.random.choice(self.members[board.key])
+                completed = self.random.random() < 0.3
+                tasks.append(main.Task(
+                    taskboard=board.key, taskboard_title=board.title, title='task %d' % task_number,
+                    due_date=datetime.datetime.now() + datetime.timedelta(days=self.random.randint(-30, 30)),
+                    assigned_user=assigned.key, assigned_email=assigned.email, completed=completed,
+                    completed_date=datetime.datetime.now() if completed else None, version=task_number + 1))
+            for start in range(0, len(tasks), 500):
+                main.ndb.put_multi(tasks[start:start + 500])
+                main.ndb.put_multi([
+                    main.TaskTitle(key=main.task_title_key(board.key, task.title), taskboard=board.key,
+                                   task=task.key)
+                    for task in tasks[start:start + 500]
+                ])
+        # due date scan writes digests shown on dashboards
+        self.app.get('/tasks/duescan', extra_environ={'USER_IS_ADMIN': '1'})
+        self.run_queued_jobs()
+
+    # creator of every sampled taskboard opens dashboard, taskboard, invite page and task form
+    def read_pages(self):
+        main = self.main
+        for board in self.random.sample(self.boards, min(self.options.samples, len(self.boards))):
+            creator = board.creator.get()
+            self.login(creator)
+            boards = main.Taskboard.query(main.Taskboard.creator == creator.key).count() + \
+                main.TaskboardUser.query(main.TaskboardUser.user == creator.key).count()
+            members = len(self.members[board.key]) - 1
+            self.request('/', 'GET', '/', rows=boards)
+            response = self.request('/viewtb', 'GET', '/viewtb', {'id': board.key.id()}, rows=self.options.tasks)
+            self.request('/viewtb (304)', 'GET', '/viewtb', {'id': board.key.id()},
+                         headers={'If-None-Match': response.headers.get('ETag', '')})
+            self.request('/invite', 'GET', '/invite', {'id': board.key.id()}, rows=members)
+            self.request('/addtask', 'GET', '/addtask', {'tbid': board.key.id()}, rows=members)
+
+    # editors of one taskboard concurrently save new tasks and update existing ones
+    def edit_concurrently(self):
+        board = self.boards[0]
+        editors = self.members[board.key][:self.options.editors]
+        tasks = self.main.Task.query(self.main.Task.taskboard == board.key).fetch(
+            len(editors) * self.options.edits, keys_only=True)
+        print('%d editors making %d edits each on %s' % (len(editors), self.options.edits, board.title))
+
+        def edit(number, editor):
+            self.login(editor)
+            for edit_number in range(self.options.edits):
+                assigned = self.random.choice(self.members[board.key])
+                due_date = (datetime.datetime.now() + datetime.timedelta(days=7)).strftime('%Y-%m-%d')
+                self.request('/addtask (save)', 'POST', '/addtask', {
+                    'id': board.key.id(), 'submit': 'Save Task', 'title': 'edit %d-%d' % (number, edit_number),
+                    'due_date': due_date, 'uid': assigned.key.id()})
+                task = tasks[(number * self.options.edits + edit_number) % len(tasks)] if tasks else None
+                if task:
+                    self.request('/addtask (update)', 'POST', '/addtask', {
+                        'id': board.key.id(), 'tid': task.id(), 'submit': 'Update Task',
+                        'title': 'updated %d-%d' % (number, edit_number), 'due_date': due_date,
+                        'uid': assigned.key.id(), 'completed': '0'})
+
+        threads = [threading.Thread(target=edit, args=(number, editor)) for number, editor in enumerate(editors)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    # creator invites users and uninvites one, then background jobs run
+    def invite(self):
+        board = self.boards[-1]
+        creator = board.creator.get()
+        self.login(creator)
+        members = set(member.key for member in self.members[board.key])
+        invitees = [user for user in self.users if user.key not in members][:self.options.members]
+        self.request('/invite (post)', 'POST', '/invite',
+                     [('tbid', board.key.id())] + [('users', user.key.id()) for user in invitees])
+        uninvited = self.members[board.key][1] if len(self.members[board.key]) > 1 else None
+        if uninvited:
+            self.request('/invite (uninvite)', 'GET', '/invite?' + urllib.urlencode({
+                'id': board.key.id(), 'task': 'uninvite', 'uid': uninvited.key.id()}),
+                rows=len(self.members[board.key]) + len(invitees))
+        self.run_queued_jobs()
+
+    # creators delete sampled taskboards, then background jobs remove their tasks
+    def delete(self):
+        main = self.main
+        deleted = self.boards[1:1 + self.options.deletes]
+        for board in deleted:
+            self.login(board.creator.get())
+            self.request('/deletetb', 'GET', '/deletetb', {'id': board.key.id()})
+        self.run_queued_jobs()
+        for board in deleted:
+            if board.key.get() or main.Task.query(main.Task.taskboard == board.key).get(keys_only=True):
+                print('taskboard %s was not deleted completely' % board.key.id())
+
+    def run(self):
+        self.generate()
+        self.read_pages()
+        self.edit_concurrently()
+        self.invite()
+        self.delete()
+        failures = self.results.report()
+        self.testbed.deactivate()
+        for failure in failures:
+            print(failure)
+        return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='load and RPC budget test of taskmanagement app')
+    parser.add_argument('--sdk', default=os.environ.get('APPENGINE_SDK', ''),
+                        help='path of App Engine python SDK (google_appengine directory)')
+    parser.add_argument('--users', type=int, default=100, help='number of users')
+    parser.add_argument('--boards', type=int, default=20, help='number of taskboards')
+    parser.add_argument('--members', type=int, default=10, help='invited users per taskboard')
+    parser.add_argument('--tasks', type=int, default=200, help='tasks per taskboard')
+    parser.add_argument('--samples', type=int, default=10, help='taskboards whose pages are read')
+    parser.add_argument('--editors', type=int, default=5, help='concurrent editors on one taskboard')
+    parser.add_argument('--edits', type=int, default=10, help='edits made by each editor')
+    parser.add_argument('--deletes', type=int, default=2, help='taskboards deleted')
+    parser.add_argument('--seed', type=int, default=1, help='seed of random data')
+    options = parser.parse_args()
+    if not options.sdk:
+        parser.error('App Engine SDK path is needed, give --sdk or set APPENGINE_SDK')
+    sys.exit(Harness(options).run())
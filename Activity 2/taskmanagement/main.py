@@ -16,17 +16,51 @@
 #
 
 # import all libraries
+import time
+# time instance started loading this module, to log cold start time
+start_time = time.time()
+import logging
+import random
 import webapp2
 import jinja2
 import os
 from google.appengine.api import users
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.api import datastore_errors
 from google.appengine.ext import ndb
+# json library to send user search results
+import json
 # datetime library required to compute task completion date
 import datetime
+# hashlib to shorten long titles in title marker keys
+import hashlib
+
+
+# loads template with first loader having it.
+# ChoiceLoader of jinja2 2.6 asks loaders for template source, which ModuleLoader can't give
+class CompiledTemplateLoader(jinja2.ChoiceLoader):
+    def load(self, environment, name, globals=None):
+        for loader in self.loaders:
+            try:
+                return loader.load(environment, name, globals)
+            except jinja2.TemplateNotFound:
+                pass
+        raise jinja2.TemplateNotFound(name)
+
 
 # jinja template environment with autoescape html entities
+# templates are loaded from modules precompiled by compile_templates.py, so new instances
+# don't parse and compile them from source. html files are used only for templates not compiled,
+# their compiled code is then shared between instances through memcache.
+# compiled template is used even if its html file has been edited since, so run
+# compile_templates.py after editing templates (compile_templates.py --check finds outdated ones)
 jinja = jinja2.Environment(
-    loader=jinja2.FileSystemLoader(os.path.dirname(__file__)),
+    loader=CompiledTemplateLoader([
+        jinja2.ModuleLoader(os.path.join(os.path.dirname(__file__), 'templates_compiled')),
+        jinja2.FileSystemLoader(os.path.dirname(__file__))
+    ]),
+    bytecode_cache=jinja2.MemcachedBytecodeCache(memcache.Client()),
     extensions=['jinja2.ext.autoescape'],
     autoescape=True
 )
@@ -39,6 +73,7 @@ class MainHandler(webapp2.RequestHandler):
         # initialize user object and user's taskboard
         user_object = None
         my_taskboards = None
+        digest_tasks = None
         # if user is logged in then show taskboards dashboard
         if users.get_current_user():
             # get user object if user is in datastore
@@ -54,9 +89,13 @@ class MainHandler(webapp2.RequestHandler):
             # get all taskboards user is invited into
             invited_taskboards = TaskboardUser.query(TaskboardUser.user == user_object.key).fetch()
             # merge taskboards i.e created by user and where user is invited into
-            for invited_taskboard in invited_taskboards:
-                # appending into my_taskboards list
-                my_taskboards.append(invited_taskboard.taskboard.get())
+            # invited taskboards are got in one batch get
+            my_taskboards.extend(ndb.get_multi(map(lambda invited_taskboard: invited_taskboard.taskboard,
+                                                   invited_taskboards)))
+            # taskboards being deleted in background are not shown
+            my_taskboards = filter(lambda taskboard: taskboard and not taskboard.deleting, my_taskboards)
+            # user's overdue and due soon tasks, precomputed by due date scan
+            digest_tasks = user_digest_tasks(user_object)
 
         template_vars = {
             # login logout url
@@ -67,16 +106,91 @@ class MainHandler(webapp2.RequestHandler):
             # current user object from our datastore
             "user_object": user_object,
             # user's invited and created taskboards
-            "taskboards": my_taskboards
+            "taskboards": my_taskboards,
+            # user's overdue and due soon tasks
+            "digest_tasks": digest_tasks,
+            "now": datetime.datetime.now()
         }
         # rendering home page template from main.html
         self.response.write(jinja.get_template("main.html").render(template_vars))
 
 
+# change of a task in taskboard's change log, structured property of Taskboard
+class TaskChange(ndb.Model):
+    # version of taskboard the change was made with
+    version = ndb.IntegerProperty()
+    task = ndb.KeyProperty()
+    deleted = ndb.BooleanProperty(default=False)
+
+
+# number of latest task changes kept in taskboard's change log
+CHANGE_LOG_SIZE = 100
+
+
 # Taskboard model with attributes title to hold taskboard title and creator key attribute to hold creator user's key
 class Taskboard(ndb.Model):
     title = ndb.StringProperty()
     creator = ndb.KeyProperty()
+    # email of creator, copied so lists don't need to get creator. kept up to date by /tasks/fanout
+    creator_email = ndb.StringProperty()
+    # set when taskboard is deleted, its tasks and users are then removed in background
+    deleting = ndb.BooleanProperty(default=False)
+    # increased on every change to taskboard's title, tasks or users.
+    # used as ETag of taskboard page and to find tasks changed since a version
+    version = ndb.IntegerProperty(default=0)
+    # latest task changes, oldest first and at most CHANGE_LOG_SIZE. written in the same transaction as
+    # the tasks, and read by key, as queries on tasks may not show latest writes yet
+    changes = ndb.LocalStructuredProperty(TaskChange, repeated=True)
+    # version after which change log has every change of tasks, None until first change is logged
+    changes_since = ndb.IntegerProperty()
+
+
+# increase version of taskboard for tasks written and task keys deleted in the same transaction.
+# written tasks are stamped with new version and all are added to change log. caller puts taskboard
+def record_changes(taskboard, tasks=(), deleted=()):
+    if taskboard.changes_since is None:
+        taskboard.changes_since = taskboard.version
+    taskboard.version += 1
+    for task in tasks:
+        task.version = taskboard.version
+    taskboard.changes.extend([TaskChange(version=taskboard.version, task=task.key) for task in tasks] +
+                             [TaskChange(version=taskboard.version, task=key, deleted=True) for key in deleted])
+    # oldest changes are dropped, log then has every change after the last dropped one
+    if len(taskboard.changes) > CHANGE_LOG_SIZE:
+        taskboard.changes_since = taskboard.changes[-CHANGE_LOG_SIZE - 1].version
+        taskboard.changes = taskboard.changes[-CHANGE_LOG_SIZE:]
+
+
+# times a task write is tried when its transaction fails. every task write also writes its taskboard,
+# so concurrent editors of one taskboard collide on it
+TASK_WRITE_ATTEMPTS = 8
+# longest wait in seconds before trying again, waits double from 0.1 up to it
+TASK_WRITE_MAX_WAIT = 1
+
+
+# run transactional function, trying again after a short random wait if a concurrent transaction made it fail.
+# ndb only retries failed commits, not reads failing because another transaction committed meanwhile.
+# raises TransactionFailedError if all attempts fail, handlers then show a conflict message
+def with_retries(function, *args):
+    for attempt in range(TASK_WRITE_ATTEMPTS):
+        try:
+            return function(*args)
+        except datastore_errors.TransactionFailedError:
+            if attempt == TASK_WRITE_ATTEMPTS - 1:
+                raise
+            time.sleep(random.uniform(0, min(TASK_WRITE_MAX_WAIT, 0.1 * 2 ** attempt)))
+
+
+# change title of taskboard and increase its version.
+# title copied on tasks is updated in background
+@ndb.transactional
+def rename_taskboard(taskboard_key, title):
+    taskboard = taskboard_key.get()
+    taskboard.title = title
+    taskboard.version += 1
+    taskboard.put()
+    taskqueue.add(url='/tasks/fanout', params={"kind": "taskboard", "id": taskboard_key.id()},
+                  transactional=True)
 
 
 # User model , holds user object after user is logged in. new object is created if datastore doesn't have the email logged in with
@@ -92,6 +206,12 @@ class TaskboardUser(ndb.Model):
     user = ndb.KeyProperty()
 
 
+# key of taskboard user relation, built from taskboard and user ids
+# so membership can be checked or made with key gets instead of queries
+def membership_key(taskboard_key, user_key):
+    return ndb.Key(TaskboardUser, '%s:%s' % (taskboard_key.id(), user_key.id()))
+
+
 # Task model
 # one to many relation ship from taskboard to task. i.e one taskboard can have many tasks. but one task can have only one taskboard
 # so creating taskboard key
@@ -104,10 +224,196 @@ class Task(ndb.Model):
     due_date = ndb.DateTimeProperty()
     # user key of user the task is assigned to
     assigned_user = ndb.KeyProperty()
+    # email of assigned user and title of taskboard, copied so lists don't need to get them.
+    # kept up to date by /tasks/fanout
+    assigned_email = ndb.StringProperty()
+    taskboard_title = ndb.StringProperty()
     # flag representing task completion
     completed = ndb.BooleanProperty()
     # task completed date if complete
     completed_date = ndb.DateTimeProperty()
+    # version of taskboard when task was last written
+    version = ndb.IntegerProperty()
+
+
+# Task title marker model
+# one marker per (taskboard, normalized title). key name is built from both,
+# so checking a title for duplicates within a taskboard is a single key get.
+# markers are created and deleted in the same transaction as their task
+class TaskTitle(ndb.Model):
+    # taskboard the title belongs to
+    taskboard = ndb.KeyProperty()
+    # task currently holding the title
+    task = ndb.KeyProperty()
+
+
+# normalize task title for uniqueness check, ignoring case and repeated whitespace
+def normalize_title(title):
+    return u' '.join(title.split()).lower()
+
+
+# longest normalized title kept as is in marker key name, in utf-8 bytes.
+# key names can't be longer than 500 bytes, longer titles are replaced by their sha1
+TITLE_KEY_LENGTH = 400
+
+
+# key of title marker for given taskboard key and task title
+def task_title_key(taskboard_key, title):
+    title = normalize_title(title).encode('utf-8')
+    if len(title) > TITLE_KEY_LENGTH:
+        title = 'sha1:' + hashlib.sha1(title).hexdigest()
+    return ndb.Key(TaskTitle, '%s:%s' % (taskboard_key.id(), title))
+
+
+# save new task, or update existing task if update is set, along with its title marker
+# returns False without saving if another task on the same taskboard already holds the title,
+# or if task to update is deleted or on another taskboard.
+def save_task(task, update=False):
+    # new task gets its key first, so marker and change log can refer to it.
+    # ids can't be allocated inside a transaction
+    if not update:
+        task.key = ndb.Key(Task, Task.allocate_ids(1)[0])
+    return with_retries(read_and_write_task, task, update)
+
+
+# read stored task and write task. stored task is read before the transaction,
+# so marker of its title is read with everything else in the transaction's one batch get
+def read_and_write_task(task, update):
+    old_marker_key = None
+    if update:
+        stored_task = task.key.get(use_cache=False, use_memcache=False)
+        if stored_task and stored_task.taskboard and stored_task.title:
+            old_marker_key = task_title_key(stored_task.taskboard, stored_task.title)
+    return write_task(task, update, old_marker_key)
+
+
+# write task and its title marker for save_task, in one transaction with taskboard.
+# cross group transaction as task and marker are separate root entities
+# old_marker_key is key of title marker of stored task as read before the transaction
+@ndb.transactional(xg=True)
+def write_task(task, update, old_marker_key):
+    marker_key = task_title_key(task.taskboard, task.title)
+    # taskboard, marker, stored task, its old marker and assigned user in one batch get.
+    # entity groups read one after another fail the transaction if another transaction commits
+    # to an earlier one in between
+    entities = ndb.get_multi([task.taskboard, marker_key, task.key, old_marker_key or marker_key] +
+                             ([task.assigned_user] if task.assigned_user else []))
+    taskboard, marker, old_task, old_marker = entities[:4]
+    assigned_user = entities[4] if task.assigned_user else None
+    # tasks can't be added to taskboard being deleted
+    if not taskboard or taskboard.deleting:
+        return False
+    # task deleted meanwhile isn't brought back, and task of another taskboard isn't moved here,
+    # that taskboard's title marker and version would be left behind
+    if update and (not old_task or old_task.taskboard != task.taskboard):
+        return False
+    # title taken by some other task on this taskboard
+    if marker and marker.task != task.key:
+        return False
+    if old_task and old_task.taskboard and old_task.title:
+        # title changed since stored task was read, read again in a new attempt
+        if task_title_key(old_task.taskboard, old_task.title) != old_marker_key:
+            raise datastore_errors.TransactionFailedError('task changed since it was read')
+        # on update release the marker of previous title if title has changed
+        if old_marker_key != marker_key and old_marker and old_marker.task == task.key:
+            old_marker.key.delete()
+    # copy display fields of taskboard and assigned user on task
+    task.taskboard_title = taskboard.title
+    task.assigned_email = assigned_user.email if assigned_user else None
+    # stamp task with taskboard's new version
+    record_changes(taskboard, [task])
+    ndb.put_multi([task, TaskTitle(key=marker_key, taskboard=task.taskboard, task=task.key), taskboard])
+    return True
+
+
+# delete task of given taskboard along with its title marker
+def delete_task(task_key, taskboard_key):
+    with_retries(read_and_remove_task, task_key, taskboard_key)
+
+
+# read stored task before the transaction, so its title marker is read in the transaction's one batch get
+def read_and_remove_task(task_key, taskboard_key):
+    stored_task = task_key.get(use_cache=False, use_memcache=False)
+    marker_key = None
+    if stored_task and stored_task.taskboard and stored_task.title:
+        marker_key = task_title_key(stored_task.taskboard, stored_task.title)
+    remove_task(task_key, taskboard_key, marker_key)
+
+
+# delete task and its title marker for delete_task, in one transaction with taskboard.
+# task of another taskboard is not deleted
+@ndb.transactional(xg=True)
+def remove_task(task_key, taskboard_key, marker_key):
+    # task, taskboard and marker in one batch get, as in write_task
+    task, taskboard, marker = ndb.get_multi([task_key, taskboard_key, marker_key or task_key])
+    if task and task.taskboard == taskboard_key:
+        # title changed since task was read, read again in a new attempt
+        if task.title and task_title_key(task.taskboard, task.title) != marker_key:
+            raise datastore_errors.TransactionFailedError('task changed since it was read')
+        keys = [task_key]
+        # delete marker only if it belongs to this task
+        if marker_key and marker and marker.task == task_key:
+            keys.append(marker_key)
+        ndb.delete_multi(keys)
+        # record deletion with taskboard's new version
+        if taskboard:
+            record_changes(taskboard, deleted=[task_key])
+            taskboard.put()
+
+
+# task in due date digest, structured property of TaskDigest
+class DigestTask(ndb.Model):
+    task = ndb.KeyProperty()
+    taskboard = ndb.KeyProperty()
+    title = ndb.StringProperty()
+    due_date = ndb.DateTimeProperty()
+
+
+# overdue and due soon tasks of a user found by one shard of due date scan.
+# key is built from user id and slot of shard, so every digest entity is written by one shard job only
+# and dashboard reads all digests of user with one batch get
+class TaskDigest(ndb.Model):
+    user = ndb.KeyProperty()
+    # time of scan run that wrote this digest
+    run = ndb.DateTimeProperty()
+    # shard that wrote this digest, slots are reused by later shards
+    shard = ndb.IntegerProperty()
+    tasks = ndb.StructuredProperty(DigestTask, repeated=True)
+
+
+# times of current and previous due date scan runs, single entity with key name 'latest'.
+# digests written by older runs are outdated and not shown
+class DigestRun(ndb.Model):
+    current = ndb.DateTimeProperty()
+    previous = ndb.DateTimeProperty()
+    # shards current run has finished, their digests of previous run are outdated
+    completed = ndb.IntegerProperty(repeated=True)
+
+
+# get logged in user's object from datastore, adding it if not there yet
+# returns None if no user is logged in
+def current_user_object():
+    if not users.get_current_user():
+        return None
+    user_object = User.query(User.email == users.get_current_user().email()).get()
+    if not user_object:
+        user_object = User(email=users.get_current_user().email())
+        user_object.put()
+    return user_object
+
+
+# check if user is creator of taskboard or invited into it
+def has_access(user_object, taskboard):
+    if not taskboard or taskboard.deleting:
+        return False
+    if taskboard.creator == user_object.key:
+        return True
+    # relation is found by its key, relations made before membership keys were used
+    # and not backfilled yet only by query
+    return membership_key(taskboard.key, user_object.key).get() is not None or TaskboardUser.query(
+        TaskboardUser.taskboard == taskboard.key,
+        TaskboardUser.user == user_object.key
+    ).get() is not None
 
 
 # Add taskboard handler
@@ -144,7 +450,8 @@ class AddTBHandler(webapp2.RequestHandler):
         # if user object is successfully created, create a taskboard object and save it to datastore
         if user_object:
             # creating datasotre object
-            taskboard = Taskboard(title=self.request.get("title"), creator=user_object.key)
+            taskboard = Taskboard(title=self.request.get("title"), creator=user_object.key,
+                                  creator_email=user_object.email)
             # saving object
             taskboard.put()
             # redirecting to home page
@@ -195,11 +502,10 @@ class EditTBHandler(webapp2.RequestHandler):
                 user_object.put()
             # creating taskboard object
             taskboard = ndb.Key(Taskboard, int(self.request.get('id'))).get()
-            # assigning new title
-            taskboard.title = self.request.get('title')
             # only creator of taskboard can update
-            if taskboard.key.get().creator == user_object.key:
-                taskboard.put()
+            if taskboard.creator == user_object.key:
+                # assigning new title
+                rename_taskboard(taskboard.key, self.request.get('title'))
             else:
                 # show unauthorised access message
                 self.response.write('Unauthorised access!')
@@ -212,35 +518,33 @@ class EditTBHandler(webapp2.RequestHandler):
 
 class ViewTBHandler(webapp2.RequestHandler):
     def get(self):
+        user_object = current_user_object()
         # if not logged in, send login message
-        if users.get_current_user():
-            # if logged in get user object from datastore
-            user_object = User.query(User.email == users.get_current_user().email()).get()
-            # if user object not in datastore, create add in datastore
-            if not user_object:
-                user_object = User(email=users.get_current_user().email())
-                user_object.put()
-
-            # to check if user can add task to taskboard.
-            # get all users' created taskboard
-            my_taskboards = Taskboard.query(Taskboard.creator == user_object.key).fetch()
-            # and get all taskboard where user is invited
-            invited_taskboards = TaskboardUser.query(TaskboardUser.user == user_object.key).fetch()
-            # merge invited taskboards and create taskboards
-            for invited_taskboard in invited_taskboards:
-                my_taskboards.append(invited_taskboard.taskboard.get())
-
+        if user_object:
             my_tb = ndb.Key(Taskboard, int(self.request.get('id'))).get()
 
             # if current taskboard is in users authorised board then proceed
-            if my_tb in my_taskboards:
-                tb_tasks = Task.query(Task.taskboard == my_tb.key).fetch()
+            if has_access(user_object, my_tb):
+                # page only changes with taskboard version, so browser can keep its copy
+                # and page is not built again if it already has the current version
+                # deployed version is part of it, so a new deploy with changed templates isn't answered with 304
+                etag = '"%s-%s-%s"' % (my_tb.key.id(), my_tb.version, os.environ.get('CURRENT_VERSION_ID', ''))
+                self.response.headers['ETag'] = etag
+                self.response.headers['Cache-Control'] = 'private, no-cache'
+                if etag in map(lambda tag: tag.strip(), self.request.headers.get('If-None-Match', '').split(',')) \
+                        and not self.request.get('imported'):
+                    self.response.set_status(304)
+                    return
+
+                tb_tasks = with_logged_changes(my_tb, Task.query(Task.taskboard == my_tb.key).fetch())
                 template_vars = {
                     "url": users.create_logout_url("/") if users.get_current_user() else users.create_login_url("/"),
                     "user": users.get_current_user(),
                     "my_tb": my_tb,
-                    "my_tb_creator": my_tb.creator.get(),
-                    "tb_tasks": tb_tasks
+                    "tb_tasks": tb_tasks,
+                    # result of task import if redirected from /import
+                    "imported": self.request.get('imported'),
+                    "skipped": self.request.get('skipped')
                 }
 
                 self.response.write(jinja.get_template('viewtb.html').render(template_vars))
@@ -250,6 +554,64 @@ class ViewTBHandler(webapp2.RequestHandler):
             self.response.write("Please <a href=\"" + users.create_login_url() + "\">Login</a> to continue")
 
 
+# tasks of taskboard from a query, with tasks of taskboard's change log read again by key.
+# query on tasks may not show latest writes yet, this way page has every change up to taskboard's version
+def with_logged_changes(taskboard, tasks):
+    logged = list(set(change.task for change in taskboard.changes))
+    if not logged:
+        return tasks
+    # latest state of logged tasks in one batch get, None for deleted tasks
+    current = dict(zip(logged, ndb.get_multi(logged)))
+    tasks = dict((task.key, task) for task in tasks)
+    tasks.update(current)
+    # in key order, as from query
+    return [task for key, task in sorted(tasks.items(), key=lambda item: item[0].id())
+            if task and task.taskboard == taskboard.key]
+
+
+# tasks of taskboard changed since a version, for clients to update only changed rows
+# /viewtb/changes?id=taskboard_id&since=version
+# served from taskboard's change log. client reloads page if changes since its version are no longer in log
+class TBChangesHandler(webapp2.RequestHandler):
+    def get(self):
+        user_object = current_user_object()
+        if user_object:
+            my_tb = ndb.Key(Taskboard, int(self.request.get('id'))).get()
+            if has_access(user_object, my_tb):
+                try:
+                    since = int(self.request.get('since') or 0)
+                except ValueError:
+                    self.response.set_status(400)
+                    self.response.write("Invalid version")
+                    return
+                changes = {"version": my_tb.version, "tasks": [], "deleted": [], "reload": False}
+                if since < my_tb.version:
+                    if my_tb.changes_since is None or since < my_tb.changes_since:
+                        # too many changes, cheaper for client to reload whole page
+                        changes["reload"] = True
+                    else:
+                        # latest change of every task changed after given version
+                        latest = dict((change.task, change) for change in my_tb.changes if change.version > since)
+                        written = [key for key, change in latest.items() if not change.deleted]
+                        # tasks read by key, so they are never older than change log
+                        tasks = filter(lambda task: task and task.taskboard == my_tb.key, ndb.get_multi(written))
+                        emails = assigned_emails(tasks)
+                        for task in sorted(tasks, key=lambda task: task.version):
+                            row = task_row(task, emails)
+                            row["id"] = task.key.id()
+                            row["version"] = task.version
+                            changes["tasks"].append(row)
+                        # tasks deleted, or deleted after being written
+                        found = set(task.key for task in tasks)
+                        changes["deleted"] = [key.id() for key in latest if key not in found]
+                self.response.headers['Content-Type'] = 'application/json'
+                self.response.write(json.dumps(changes))
+            else:
+                self.response.write("Unauthorised access!!")
+        else:
+            self.response.write("Please <a href=\"" + users.create_login_url() + "\">Login</a> to continue")
+
+
 class DeleteTBHandler(webapp2.RequestHandler):
     def get(self):
         if users.get_current_user():
@@ -259,17 +621,13 @@ class DeleteTBHandler(webapp2.RequestHandler):
             if not user_object:
                 user_object = User(email=users.get_current_user().email())
                 user_object.put()
+            taskboard = key.get()
             #     only creator of taskboard can delete taskboard
-            if key.get().creator == user_object.key:
-                # creator can delete if and only if taskboard doesn't contain any tasks and any invited users.
-                # i.e taskboard should not be referenced by any user for task
-
-                # get  tasks of taskboard, and users invited to taskboard.
-
-                if not Task.query(Task.taskboard == key).get() and not TaskboardUser.query(
-                        TaskboardUser.taskboard == key).get():
-                    # if no tasks and no users, perform delete
-                    key.delete()
+            if taskboard.creator == user_object.key:
+                # taskboard is marked as deleting right away and hidden from users,
+                # its tasks and invited users are deleted in background along with taskboard itself
+                if not taskboard.deleting:
+                    mark_deleting(key)
                 #     redirect to home page
                 self.redirect('/')
             else:
@@ -281,6 +639,16 @@ class DeleteTBHandler(webapp2.RequestHandler):
             self.response.write("Please <a href=\"" + users.create_login_url() + "\">Login</a> to continue")
 
 
+# mark taskboard as deleting and add job deleting it, in one transaction
+# so taskboard is never left marked without a job to delete it
+@ndb.transactional
+def mark_deleting(taskboard_key):
+    taskboard = taskboard_key.get()
+    taskboard.deleting = True
+    taskboard.put()
+    taskqueue.add(url='/tasks/deletetb', params={"id": taskboard_key.id()}, transactional=True)
+
+
 # add other user to this taskboard
 class InviteToTBHandler(webapp2.RequestHandler):
     # show invitation form and invited users table
@@ -302,32 +670,31 @@ class InviteToTBHandler(webapp2.RequestHandler):
                     # getting user for which uninvite button is clicked
                     uninvite_user = ndb.Key(User, int(self.request.get('uid')))
                     # get taskboard user from TaskboardUser datastore.
-                    tbu = TaskboardUser.query(
+                    # relations made before membership keys were used and not backfilled yet
+                    # only can be found by query, every relation of user is removed
+                    legacy_keys = TaskboardUser.query(
                         TaskboardUser.taskboard == taskboard.key,
                         TaskboardUser.user == uninvite_user
-                    ).get()
-                    # if exists
-                    if tbu:
-                        # get all tasks user is added in this taskboard and unassign him from all tasks
-                        tasks = Task.query(Task.assigned_user == uninvite_user).filter(
-                            Task.taskboard == taskboard.key).fetch()
-                        for task in tasks:
-                            # unassigning user from every associated task in particular taskboard
-                            task.assigned_user = None
-                            task.put()
-                        # now safely performing after removing all associations to tasks in taskboard
-                        tbu.key.delete()
+                    ).fetch(keys_only=True)
+                    try:
+                        # remove user from taskboard right away, user's tasks in this taskboard
+                        # are unassigned in background as there can be many of them
+                        with_retries(remove_member, taskboard.key, uninvite_user, legacy_keys)
+                    except datastore_errors.TransactionFailedError:
+                        self.response.set_status(409)
+                        self.response.write("Taskboard was changed by someone else at the same time, "
+                                            "please go back and try again.")
+                        return
 
                 invited_users_tb = TaskboardUser.query(TaskboardUser.taskboard == taskboard.key).fetch()
-                # getting all already invited users to show in invite users page.
-                invited_users = map(lambda invited_user: invited_user.user.get(), invited_users_tb)
+                # getting all already invited users to show in invite users page, in one batch get
+                invited_users = ndb.get_multi(map(lambda invited_user: invited_user.user, invited_users_tb))
 
                 template_vars = {
                     "url": users.create_logout_url("/") if users.get_current_user() else users.create_login_url("/"),
                     "user": users.get_current_user(),
                     "user_object": user_object,
-                    # all users in the system, to add them to taskboard
-                    "my_users": User.query(User.key != user_object.key).fetch(),
+                    # users to add are searched from /invite/users, so page doesn't list every user
                     "invited_users": invited_users,
                     "my_tb": taskboard
                 }
@@ -353,21 +720,32 @@ class InviteToTBHandler(webapp2.RequestHandler):
                 user_object.put()
             # taskboard to add user into
             my_tb = ndb.Key(Taskboard, int(self.request.get("tbid"))).get()
-            # only if currently user is the creator of taskboard
-            if my_tb.creator == user_object.key:
+            # only if currently user is the creator of taskboard, and taskboard isn't being deleted
+            if my_tb.creator == user_object.key and not my_tb.deleting:
                 # now authorised to invite
 
                 # get all users selected from the form
-                selected_users = self.request.get_all('users')
-                # for each selected user, check if association to same taskboard is made previously
-                for selected_user in selected_users:
-                    selected_user = ndb.Key(User, int(selected_user))
-                    tb_user = TaskboardUser.query(TaskboardUser.taskboard == taskboard,
-                                                  TaskboardUser.user == selected_user).fetch()
-                    # if association is not already made, it is safe to make now.
-                    if not tb_user:
-                        # making association
-                        TaskboardUser(taskboard=taskboard, user=selected_user).put()
+                selected_users = map(lambda selected_user: ndb.Key(User, int(selected_user)),
+                                     self.request.get_all('users'))
+                # check in one batch get if association to same taskboard is made previously
+                tb_users = ndb.get_multi(map(lambda selected_user: membership_key(taskboard, selected_user),
+                                             selected_users))
+                # if association is not already made, it is safe to make now.
+                # a keyed relation made next to a legacy one is merged by /tasks/backfill/memberships
+                new_tb_users = [
+                    TaskboardUser(key=membership_key(taskboard, selected_user), taskboard=taskboard, user=selected_user)
+                    for selected_user, tb_user in zip(selected_users, tb_users)
+                    if not tb_user
+                ]
+                # in transactions with taskboard's version, within the 25 entity groups limit
+                try:
+                    for start in range(0, len(new_tb_users), INVITE_TRANSACTION_SIZE):
+                        with_retries(add_members, taskboard, new_tb_users[start:start + INVITE_TRANSACTION_SIZE])
+                except datastore_errors.TransactionFailedError:
+                    self.response.set_status(409)
+                    self.response.write("Taskboard was changed by someone else at the same time, "
+                                        "please go back and try again.")
+                    return
                 self.redirect("/invite?id=" + self.request.get('tbid'))
             else:
                 # not authorised to invite
@@ -380,6 +758,482 @@ class InviteToTBHandler(webapp2.RequestHandler):
             self.response.write("Please <a href=\"" + users.create_login_url() + "\">Login</a> to continue")
 
 
+# users added to taskboard by one invite transaction, together with taskboard within the 25 entity groups limit
+INVITE_TRANSACTION_SIZE = 24
+
+
+# add taskboard user relations and increase taskboard's version, in one transaction.
+# relations made meanwhile are kept as they are, nothing is added to taskboard being deleted
+@ndb.transactional(xg=True)
+def add_members(taskboard_key, tb_users):
+    entities = ndb.get_multi([taskboard_key] + map(lambda tb_user: tb_user.key, tb_users))
+    taskboard = entities[0]
+    new_tb_users = [tb_user for tb_user, stored in zip(tb_users, entities[1:]) if not stored]
+    if taskboard and not taskboard.deleting and new_tb_users:
+        taskboard.version += 1
+        ndb.put_multi(new_tb_users + [taskboard])
+
+
+# remove user from taskboard with its keyed relation and legacy relations, increase taskboard's version
+# and add job unassigning user's tasks, in one transaction
+@ndb.transactional(xg=True)
+def remove_member(taskboard_key, user_key, legacy_keys):
+    taskboard, tb_user = ndb.get_multi([taskboard_key, membership_key(taskboard_key, user_key)])
+    keys = list(legacy_keys) + ([tb_user.key] if tb_user else [])
+    if taskboard and keys:
+        ndb.delete_multi(keys)
+        taskboard.version += 1
+        taskboard.put()
+        taskqueue.add(url='/tasks/unassign', params={"tbid": taskboard_key.id(), "uid": user_key.id()},
+                      transactional=True)
+
+
+# number of tasks updated in one batch by background jobs
+TASK_BATCH_SIZE = 200
+
+
+# tasks unassigned by one transaction, together with taskboard within the 25 entity groups limit
+UNASSIGN_TRANSACTION_SIZE = 24
+
+
+# background job unassigning uninvited user from his tasks in a taskboard
+# /tasks/unassign, run from task queue
+# works in batches and adds itself again with cursor until all tasks are done,
+# so large taskboards never run into request deadline
+class UnassignUserHandler(webapp2.RequestHandler):
+    def post(self):
+        taskboard = ndb.Key(Taskboard, int(self.request.get('tbid')))
+        unassign_user = ndb.Key(User, int(self.request.get('uid')))
+        # continue from where previous batch stopped
+        cursor = ndb.Cursor(urlsafe=self.request.get('cursor')) if self.request.get('cursor') else None
+        keys, next_cursor, more = Task.query(Task.assigned_user == unassign_user, Task.taskboard == taskboard) \
+            .fetch_page(TASK_BATCH_SIZE, start_cursor=cursor, keys_only=True)
+        for start in range(0, len(keys), UNASSIGN_TRANSACTION_SIZE):
+            # nothing more to do if taskboard is deleted meanwhile
+            if not unassign_tasks(taskboard, unassign_user, keys[start:start + UNASSIGN_TRANSACTION_SIZE]):
+                return
+        # schedule next batch
+        if more and next_cursor:
+            taskqueue.add(url='/tasks/unassign', params={
+                "tbid": taskboard.id(),
+                "uid": unassign_user.id(),
+                "cursor": next_cursor.urlsafe()
+            })
+
+
+# unassign user from tasks in one transaction. every task is read again and changed only if it is
+# still assigned to user, so edits made since the query are kept, and stamped with taskboard's new version.
+# returns False without changes if taskboard is deleted or being deleted,
+# putting tasks back would bring them to life again
+@ndb.transactional(xg=True)
+def unassign_tasks(taskboard_key, user_key, task_keys):
+    taskboard = taskboard_key.get()
+    if not taskboard or taskboard.deleting:
+        return False
+    tasks = filter(lambda task: task and task.taskboard == taskboard_key and task.assigned_user == user_key,
+                   ndb.get_multi(task_keys))
+    if tasks:
+        for task in tasks:
+            # unassigning user from every associated task in particular taskboard
+            task.assigned_user = None
+            task.assigned_email = None
+        record_changes(taskboard, tasks)
+        ndb.put_multi(tasks + [taskboard])
+    return True
+
+
+# display fields copied by fan-out job, for each kind of changed entity.
+# list of model, property referring to changed entity, copied field, field of changed entity
+# and whether copied field is shown on taskboard page, so taskboard's version is increased when it changes
+FANOUT_FIELDS = {
+    "taskboard": (Taskboard, [(Task, 'taskboard', 'taskboard_title', 'title', False)]),
+    "user": (User, [(Taskboard, 'creator', 'creator_email', 'email', True),
+                    (Task, 'assigned_user', 'assigned_email', 'email', True)])
+}
+
+
+# background job copying changed taskboard title or user email on entities showing them
+# /tasks/fanout?kind=taskboard|user&id=..., run from task queue
+# updates one batch per run and adds itself again with step and cursor to continue from
+class FanoutHandler(webapp2.RequestHandler):
+    def post(self):
+        source_model, fields = FANOUT_FIELDS[self.request.get('kind')]
+        source = ndb.Key(source_model, int(self.request.get('id'))).get()
+        if not source:
+            return
+        # index of field in fields being updated and cursor within it
+        step = int(self.request.get('step') or 0)
+        cursor = ndb.Cursor(urlsafe=self.request.get('cursor')) if self.request.get('cursor') else None
+        if step >= len(fields):
+            return
+        model, reference, field, source_field, shown = fields[step]
+        keys, next_cursor, more = model.query(getattr(model, reference) == source.key).fetch_page(
+            TASK_BATCH_SIZE, start_cursor=cursor, keys_only=True)
+        # every entity is updated in a transaction of its own
+        for key in keys:
+            copy_field(key, source.key, reference, field, source_field, shown)
+        # continue with same field if it has more, else move to next field
+        params = {"kind": self.request.get('kind'), "id": source.key.id(), "step": step}
+        if more and next_cursor:
+            params["cursor"] = next_cursor.urlsafe()
+        else:
+            params["step"] = step + 1
+        if params["step"] < len(fields):
+            taskqueue.add(url='/tasks/fanout', params=params)
+
+
+# copy field of changed entity on one entity referring to it, in one transaction.
+# entity and changed entity are read again, and only copied field is written if entity still refers to
+# changed entity and has another value, so concurrent edits are kept and deleted entities are not brought back.
+# entities of taskboards being deleted are left to the delete job
+@ndb.transactional(xg=True)
+def copy_field(key, source_key, reference, field, source_field, shown):
+    entity, source = ndb.get_multi([key, source_key])
+    if not entity or not source or getattr(entity, reference) != source_key:
+        return
+    value = getattr(source, source_field)
+    if getattr(entity, field) == value:
+        return
+    taskboard = entity if isinstance(entity, Taskboard) else entity.taskboard.get() if entity.taskboard else None
+    if not taskboard or taskboard.deleting:
+        return
+    setattr(entity, field, value)
+    if shown and taskboard is entity:
+        taskboard.version += 1
+    elif shown:
+        # task rows polled by clients are in change log
+        record_changes(taskboard, [entity])
+    ndb.put_multi([entity, taskboard] if shown and taskboard is not entity else [entity])
+
+
+# kinds removed by taskboard delete job in order, with property referring to taskboard.
+# taskboard itself is deleted after all of them
+TASKBOARD_CHILD_KINDS = [
+    (Task, Task.taskboard),
+    (TaskTitle, TaskTitle.taskboard),
+    (TaskboardUser, TaskboardUser.taskboard)
+]
+
+
+# background job deleting a taskboard marked as deleting, along with all its tasks and users
+# /tasks/deletetb, run from task queue
+# deletes one batch of keys per run and adds itself again with kind and cursor to continue from,
+# so it resumes where it stopped if interrupted
+class DeleteTBJobHandler(webapp2.RequestHandler):
+    def post(self):
+        key = ndb.Key(Taskboard, int(self.request.get('id')))
+        taskboard = key.get()
+        # only taskboards marked for deleting are processed
+        if not taskboard or not taskboard.deleting:
+            return
+        # index of kind in TASKBOARD_CHILD_KINDS being deleted and cursor within it
+        kind = int(self.request.get('kind') or 0)
+        cursor = ndb.Cursor(urlsafe=self.request.get('cursor')) if self.request.get('cursor') else None
+        if kind < len(TASKBOARD_CHILD_KINDS):
+            model, prop = TASKBOARD_CHILD_KINDS[kind]
+            # keys only query, entities are not needed to delete them
+            keys, next_cursor, more = model.query(prop == key).fetch_page(
+                TASK_BATCH_SIZE, start_cursor=cursor, keys_only=True)
+            ndb.delete_multi(keys)
+            # continue with same kind if it has more, else move to next kind
+            params = {"id": key.id(), "kind": kind}
+            if more and next_cursor:
+                params["cursor"] = next_cursor.urlsafe()
+            else:
+                params["kind"] = kind + 1
+            taskqueue.add(url='/tasks/deletetb', params=params)
+        else:
+            # everything referring to taskboard is deleted
+            key.delete()
+
+
+# one-off backfill jobs, run over all entities of a kind after deploying a change to how they are stored.
+# started by admin opening /tasks/backfill/..., then continue from task queue one batch of keys per run
+class BackfillHandler(webapp2.RequestHandler):
+    # model whose entities are backfilled
+    model = None
+
+    # backfill one batch of keys, done by every backfill job
+    def backfill(self, keys):
+        raise NotImplementedError()
+
+    def get(self):
+        self.post()
+        self.response.write('Backfill started')
+
+    def post(self):
+        cursor = ndb.Cursor(urlsafe=self.request.get('cursor')) if self.request.get('cursor') else None
+        keys, next_cursor, more = self.model.query().fetch_page(TASK_BATCH_SIZE, start_cursor=cursor,
+                                                                keys_only=True)
+        self.backfill(keys)
+        # schedule next batch
+        if more and next_cursor:
+            taskqueue.add(url=self.request.path, params={"cursor": next_cursor.urlsafe()})
+
+
+# re-keys taskboard user relations made before membership keys were used
+# /tasks/backfill/memberships
+class MembershipBackfillHandler(BackfillHandler):
+    model = TaskboardUser
+
+    def backfill(self, keys):
+        for key in keys:
+            # relations with membership key have key names
+            if key.integer_id():
+                rekey_membership(key)
+
+
+# replace taskboard user relation having auto id with one keyed by membership_key.
+# relations of taskboards being deleted are left to the delete job
+@ndb.transactional(xg=True)
+def rekey_membership(key):
+    tb_user = key.get()
+    if not tb_user:
+        return
+    taskboard = tb_user.taskboard.get() if tb_user.taskboard else None
+    if taskboard and not taskboard.deleting and tb_user.user:
+        new_key = membership_key(tb_user.taskboard, tb_user.user)
+        if not new_key.get():
+            TaskboardUser(key=new_key, taskboard=tb_user.taskboard, user=tb_user.user).put()
+        key.delete()
+
+
+# writes title markers of tasks saved before markers were used
+# /tasks/backfill/titles
+class TitleBackfillHandler(BackfillHandler):
+    model = Task
+
+    def backfill(self, keys):
+        for key in keys:
+            mark_title(key)
+
+
+# write title marker of task if its title has none. when legacy tasks share a title the first one marked
+# keeps it, the others keep their titles but are checked like any other task when they are saved again
+@ndb.transactional(xg=True)
+def mark_title(task_key):
+    task = task_key.get()
+    if task and task.taskboard and task.title:
+        marker_key = task_title_key(task.taskboard, task.title)
+        if not marker_key.get():
+            TaskTitle(key=marker_key, taskboard=task.taskboard, task=task_key).put()
+
+
+# copies display fields on entities saved before those fields were copied, fields are the ones of FANOUT_FIELDS
+# /tasks/backfill/tasks and /tasks/backfill/taskboards
+class FieldBackfillHandler(BackfillHandler):
+    def backfill(self, keys):
+        # reference, copied field and field of referred entity, for fields copied on this model
+        fields = [(reference, field, source_field)
+                  for source_model, copies in FANOUT_FIELDS.values()
+                  for model, reference, field, source_field, shown in copies if model is self.model]
+        for key in keys:
+            fill_fields(key, fields)
+
+
+# task fields, taskboard title and assigned user's email
+class TaskFieldBackfillHandler(FieldBackfillHandler):
+    model = Task
+
+
+# taskboard fields, creator's email
+class TaskboardFieldBackfillHandler(FieldBackfillHandler):
+    model = Taskboard
+
+
+# write missing copied fields of entity, in one transaction. fields already copied are left as they are,
+# they are kept up to date by the fan-out job. copied values are the ones pages showed before,
+# so taskboard version isn't increased
+@ndb.transactional(xg=True)
+def fill_fields(key, fields):
+    entity = key.get()
+    if not entity:
+        return
+    missing = [(reference, field, source_field) for reference, field, source_field in fields
+               if getattr(entity, field) is None and getattr(entity, reference)]
+    if not missing:
+        return
+    # referred entities in one batch get
+    sources = ndb.get_multi([getattr(entity, reference) for reference, field, source_field in missing])
+    for (reference, field, source_field), source in zip(missing, sources):
+        if source:
+            setattr(entity, field, getattr(source, source_field))
+    entity.put()
+
+
+# tasks due within these many days are due soon
+DUE_SOON_DAYS = 2
+# tasks overdue up to these many days are scanned, older ones are not shown
+OVERDUE_DAYS = 90
+# days of due dates in one time range shard. shards are fixed ranges counted from SCAN_EPOCH,
+# so a task is in the same shard in every run until its due date changes
+SHARD_DAYS = 3
+SCAN_EPOCH = datetime.datetime(2000, 1, 1)
+# digest slots of a user, more than shards scanned by one run so current and previous runs don't share slots
+DIGEST_SLOTS = (OVERDUE_DAYS + DUE_SOON_DAYS) // SHARD_DAYS + 3
+# maximum number of tasks kept in one digest
+DIGEST_TASK_LIMIT = 100
+# format of times passed to scan jobs
+SCAN_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+# shard of a due date
+def due_shard(due_date):
+    return (due_date - SCAN_EPOCH).days // SHARD_DAYS
+
+
+# start of due date range of shard, range ends at start of next shard
+def shard_start(shard):
+    return SCAN_EPOCH + datetime.timedelta(days=shard * SHARD_DAYS)
+
+
+# shards from OVERDUE_DAYS ago up to DUE_SOON_DAYS ahead of given time
+def due_shards(now):
+    return range(due_shard(now - datetime.timedelta(days=OVERDUE_DAYS)),
+                 due_shard(now + datetime.timedelta(days=DUE_SOON_DAYS)) + 1)
+
+
+# key of user's digest written by given shard
+def digest_key(user_key, shard):
+    return ndb.Key(TaskDigest, '%s:%s' % (user_key.id(), shard % DIGEST_SLOTS))
+
+
+# overdue and due soon tasks of user from digests of latest scan runs, sorted by due date
+def user_digest_tasks(user_object):
+    digest_run = ndb.Key(DigestRun, 'latest').get()
+    if not digest_run:
+        return []
+    now = datetime.datetime.now()
+    shards = due_shards(now)
+    # all shards of user's digest in one batch get
+    digests = ndb.get_multi([digest_key(user_object.key, shard) for shard in shards])
+    current = []
+    previous = []
+    for shard, digest in zip(shards, digests):
+        if not digest or digest.shard != shard:
+            continue
+        # digests of current run, or of previous run for shards current run hasn't finished yet
+        if digest.run == digest_run.current:
+            current.extend(digest.tasks)
+        elif digest.run == digest_run.previous and shard not in digest_run.completed:
+            previous.extend(digest.tasks)
+    # task moved to another shard since previous run is shown once, as found by current run
+    digest_tasks = dict((digest_task.task, digest_task) for digest_task in previous + current)
+    # shards at both ends also have tasks just outside shown range
+    start = now - datetime.timedelta(days=OVERDUE_DAYS)
+    end = now + datetime.timedelta(days=DUE_SOON_DAYS)
+    digest_tasks = filter(lambda digest_task: start <= digest_task.due_date < end, digest_tasks.values())
+    # taskboards of digest tasks in one batch get, tasks of taskboards deleted since the scan are not shown
+    taskboard_keys = list(set(digest_task.taskboard for digest_task in digest_tasks))
+    taskboards = set(taskboard.key for taskboard in ndb.get_multi(taskboard_keys)
+                     if taskboard and not taskboard.deleting)
+    digest_tasks = filter(lambda digest_task: digest_task.taskboard in taskboards, digest_tasks)
+    return sorted(digest_tasks, key=lambda digest_task: digest_task.due_date)
+
+
+# due date scan, run from cron
+# /tasks/duescan
+# adds a job for each time range shard from OVERDUE_DAYS ago up to DUE_SOON_DAYS ahead,
+# so scan of millions of tasks is spread over parallel jobs
+class DueScanHandler(webapp2.RequestHandler):
+    def get(self):
+        now = datetime.datetime.now()
+        # record new run, digests of previous run stay valid until this run has written them
+        digest_run = ndb.Key(DigestRun, 'latest').get() or DigestRun(id='latest')
+        digest_run.previous = digest_run.current
+        digest_run.current = now
+        digest_run.completed = []
+        digest_run.put()
+        for shard in due_shards(now):
+            taskqueue.add(url='/tasks/duescan/shard', params={
+                "run": now.strftime(SCAN_TIME_FORMAT),
+                "shard": shard
+            })
+
+
+# record shard as finished by scan run, if run is still current
+@ndb.transactional
+def complete_shard(run, shard):
+    digest_run = ndb.Key(DigestRun, 'latest').get()
+    if digest_run and digest_run.current == run and shard not in digest_run.completed:
+        digest_run.completed.append(shard)
+        digest_run.put()
+
+
+# one time range shard of due date scan, run from task queue
+# /tasks/duescan/shard
+# pages through incomplete tasks due in shard's range with due date index,
+# writes digests of users in each page in batch and adds itself again with cursor for next page
+class DueScanShardHandler(webapp2.RequestHandler):
+    def post(self):
+        run = datetime.datetime.strptime(self.request.get('run'), SCAN_TIME_FORMAT)
+        shard = int(self.request.get('shard'))
+        cursor = ndb.Cursor(urlsafe=self.request.get('cursor')) if self.request.get('cursor') else None
+        query = Task.query(Task.completed == False, Task.due_date >= shard_start(shard),
+                           Task.due_date < shard_start(shard + 1))
+        tasks, next_cursor, more = query.order(Task.due_date).fetch_page(TASK_BATCH_SIZE, start_cursor=cursor)
+        # only assigned tasks with due date go into digests
+        tasks = filter(lambda task: task.assigned_user and task.due_date, tasks)
+        # digests of all users in this page in one batch get
+        user_keys = list(set(task.assigned_user for task in tasks))
+        digests = dict(zip(user_keys, ndb.get_multi([digest_key(user_key, shard) for user_key in user_keys])))
+        for user_key in user_keys:
+            # digest written by an older run or another shard is started again
+            if not digests[user_key] or digests[user_key].run != run or digests[user_key].shard != shard:
+                digests[user_key] = TaskDigest(key=digest_key(user_key, shard), user=user_key, run=run,
+                                               shard=shard, tasks=[])
+        for task in tasks:
+            digest = digests[task.assigned_user]
+            if len(digest.tasks) < DIGEST_TASK_LIMIT:
+                digest.tasks.append(DigestTask(task=task.key, taskboard=task.taskboard, title=task.title,
+                                               due_date=task.due_date))
+        ndb.put_multi(digests.values())
+        # schedule next page
+        if more and next_cursor:
+            params = dict(self.request.POST.items())
+            params["cursor"] = next_cursor.urlsafe()
+            taskqueue.add(url='/tasks/duescan/shard', params=params)
+        else:
+            complete_shard(run, shard)
+
+
+# maximum number of users returned by user search
+USER_SEARCH_LIMIT = 20
+# seconds for which results of a search prefix are cached
+USER_SEARCH_CACHE_TIME = 60
+
+
+# search users by email prefix for invite form
+# /invite/users?q=prefix
+class InviteUserSearchHandler(webapp2.RequestHandler):
+    def get(self):
+        # only logged in users can search
+        if users.get_current_user():
+            # getting prefix sent as q
+            query = self.request.get('q').strip()
+            # initialising searched users container
+            account_dict = []
+            if len(query):
+                # results of every prefix are cached for a while, as same prefixes are typed again and again
+                cache_key = 'user_search:' + query.encode('utf-8')
+                account_dict = memcache.get(cache_key)
+                if account_dict is None:
+                    # all emails starting with prefix, in email order and limited.
+                    # one extra so current user can be removed and still fill the limit
+                    accounts = User.query(User.email >= query, User.email < query + u'\ufffd').order(
+                        User.email).fetch(limit=USER_SEARCH_LIMIT + 1)
+                    account_dict = map(lambda account: {"id": account.key.id(), "email": account.email}, accounts)
+                    memcache.set(cache_key, account_dict, time=USER_SEARCH_CACHE_TIME)
+                # current user can't invite himself
+                account_dict = filter(lambda account: account["email"] != users.get_current_user().email(),
+                                      account_dict)[:USER_SEARCH_LIMIT]
+            # send response as json string
+            self.response.headers['Content-Type'] = 'application/json'
+            self.response.write(json.dumps(account_dict))
+        else:
+            self.response.write("Please <a href=\"" + users.create_login_url() + "\">Login</a> to continue")
+
+
 class AddTaskToTBHandler(webapp2.RequestHandler):
     def get(self):
         # get taskboard to add task in
@@ -399,20 +1253,11 @@ class AddTaskToTBHandler(webapp2.RequestHandler):
                 "user_object": user_object,
                 "my_tb": taskboard.get()
             }
-            # to check if user can add task to taskboard.
-            # get all users' created taskboard
-            my_taskboards = Taskboard.query(Taskboard.creator == user_object.key).fetch()
-            # and get all taskboard where user is invited
-            invited_taskboards = TaskboardUser.query(TaskboardUser.user == user_object.key).fetch()
-            # merge invited taskboards and create taskboards
-            for invited_taskboard in invited_taskboards:
-                my_taskboards.append(invited_taskboard.taskboard.get())
-
-            # if current taskboard is in users authorised board then proceed
-            if taskboard.get() in my_taskboards:
-                # get all users in taskboard
+            # if user is creator of taskboard or invited into it then proceed
+            if has_access(user_object, template_vars["my_tb"]):
+                # get all users in taskboard, in one batch get
                 invited_users_records = TaskboardUser.query(TaskboardUser.taskboard == taskboard).fetch()
-                tb_users = map(lambda invited_user: invited_user.user.get(), invited_users_records)
+                tb_users = ndb.get_multi(map(lambda invited_user: invited_user.user, invited_users_records))
                 template_vars["tb_users"] = tb_users
                 template_vars["task"] = Task.get_by_id(int(self.request.get('tid'))) if self.request.get(
                     'job') == 'edittask' and len(self.request.get('tid')) else Task()
@@ -434,26 +1279,17 @@ class AddTaskToTBHandler(webapp2.RequestHandler):
                 user_object = User(email=users.get_current_user().email())
                 user_object.put()
 
-            # check if user can add task to taskboard.
-            # get all taskboards created by user
-            my_taskboards = Taskboard.query(Taskboard.creator == user_object.key).fetch()
-            # get all taskboards created for the user
-            invited_taskboards = TaskboardUser.query(TaskboardUser.user == user_object.key).fetch()
-            # merge both taskboards, as user can add for taskboards that he created and where he is invited
-            for invited_taskboard in invited_taskboards:
-                # merging here
-                my_taskboards.append(invited_taskboard.taskboard.get())
-
-            # if current taskboard is in users board list just merged.
-            if taskboard.get() in my_taskboards:
+            # check if user can add task to taskboard,
+            # user can add for taskboards that he created and where he is invited
+            if has_access(user_object, taskboard.get()):
                 # processing is authenticated.
-                if self.request.get('submit') == "Save Task":
-                    # for new task operation
-                    # again check if task with same title already exists or not.
-                    # safe to add only if doesn't exists
-                    if not Task.query(Task.title == self.request.get('title').strip()).get():
-                        Task(
-                            taskboard=ndb.Key(Taskboard, int(self.request.get('id'))),
+                try:
+                    if self.request.get('submit') == "Save Task":
+                        # for new task operation
+                        # title must be unique within taskboard, save_task checks title marker
+                        # in the same transaction and doesn't save if title already exists
+                        save_task(Task(
+                            taskboard=taskboard,
                             title=self.request.get('title').strip(),
                             due_date=datetime.datetime.strptime(self.request.get('due_date'), '%Y-%m-%d') if len(
                                 self.request.get('due_date').strip()) else None,
@@ -461,17 +1297,13 @@ class AddTaskToTBHandler(webapp2.RequestHandler):
                             if len(self.request.get('uid').strip())
                             else None,
                             completed=False
-                        ).put()
-                elif self.request.get('submit') == "Update Task":
-                    # old task edit operation
-                    # again check if task with same title already exists or not.
-                    # safe to add only if doesn't exists
-                    if not Task.query(Task.title == self.request.get('title').strip()).filter(
-                            Task.key != ndb.Key(Task, int(self.request.get("tid")))).get():
-                        # get task with tid and update
-                        Task(
+                        ))
+                    elif self.request.get('submit') == "Update Task":
+                        # old task edit operation
+                        # save_task again checks title with marker, and moves marker if title has changed
+                        save_task(Task(
                             id=int(self.request.get("tid")),
-                            taskboard=ndb.Key(Taskboard, int(self.request.get('id'))),
+                            taskboard=taskboard,
                             title=self.request.get('title').strip(),
                             completed=self.request.get('completed') and self.request.get('completed').strip() == '1',
                             due_date=datetime.datetime.strptime(self.request.get('due_date'), '%Y-%m-%d'),
@@ -480,10 +1312,16 @@ class AddTaskToTBHandler(webapp2.RequestHandler):
                             completed_date=datetime.datetime.now() if self.request.get(
                                 'completed') and self.request.get(
                                 'completed').strip() == '1' else None
-                        ).put()
-                elif self.request.get('submit') == "Delete Task":
-                    # delete the task
-                    ndb.Key(Task, int(self.request.get('tid'))).delete()
+                        ), update=True)
+                    elif self.request.get('submit') == "Delete Task":
+                        # delete the task and release its title
+                        delete_task(ndb.Key(Task, int(self.request.get('tid'))), taskboard)
+                except datastore_errors.TransactionFailedError:
+                    # taskboard kept changing by others, all attempts failed
+                    self.response.set_status(409)
+                    self.response.write("Taskboard was changed by someone else at the same time, "
+                                        "please go back and try again.")
+                    return
 
                 # redirect to view task link
                 self.redirect('/viewtb?id=' + self.request.get('id').strip())
@@ -495,13 +1333,323 @@ class AddTaskToTBHandler(webapp2.RequestHandler):
             self.response.write("Please <a href=\"" + users.create_login_url() + "\">Login</a> to continue")
 
 
+# number of tasks shown on one page of my tasks
+MY_TASKS_PAGE_SIZE = 50
+
+
+# tasks assigned to current user across all taskboards
+# /mytasks?completed=1&cursor=..&format=json
+# served from assigned_user + completed + due_date index, one page at a time
+class MyTasksHandler(webapp2.RequestHandler):
+    def get(self):
+        user_object = current_user_object()
+        if user_object:
+            # pending tasks by default, completed tasks if asked for
+            completed = self.request.get('completed') == '1'
+            cursor = ndb.Cursor(urlsafe=self.request.get('cursor')) if self.request.get('cursor') else None
+            tasks, next_cursor, more = Task.query(
+                Task.assigned_user == user_object.key,
+                Task.completed == completed
+            ).order(Task.due_date).fetch_page(MY_TASKS_PAGE_SIZE, start_cursor=cursor)
+            # taskboards of all tasks in page in one batch get, only to leave out tasks of taskboards
+            # deleted meanwhile. taskboard titles are copied on tasks
+            taskboard_keys = list(set(task.taskboard for task in tasks))
+            taskboards = set(taskboard.key
+                             for taskboard in ndb.get_multi(taskboard_keys) if taskboard and not taskboard.deleting)
+            tasks = filter(lambda task: task.taskboard in taskboards, tasks)
+            next_cursor = next_cursor.urlsafe() if more and next_cursor else None
+
+            if self.request.get('format') == 'json':
+                self.response.headers['Content-Type'] = 'application/json'
+                self.response.write(json.dumps({
+                    "tasks": map(lambda task: {
+                        "id": task.key.id(),
+                        "title": task.title,
+                        "due_date": task.due_date.strftime('%Y-%m-%d') if task.due_date else None,
+                        "completed": bool(task.completed),
+                        "completed_date": task.completed_date.strftime('%Y-%m-%d') if task.completed_date else None,
+                        "taskboard_id": task.taskboard.id(),
+                        "taskboard_title": task.taskboard_title
+                    }, tasks),
+                    "cursor": next_cursor
+                }))
+            else:
+                template_vars = {
+                    "url": users.create_logout_url("/"),
+                    "user": users.get_current_user(),
+                    "user_object": user_object,
+                    "tasks": tasks,
+                    "completed": completed,
+                    "next_cursor": next_cursor
+                }
+                self.response.write(jinja.get_template("mytasks.html").render(template_vars))
+        else:
+            self.response.write("Please <a href=\"" + users.create_login_url() + "\">Login</a> to continue")
+
+
+# columns of task import and export files, in order
+TASK_FIELDS = ['title', 'due_date', 'assigned_user', 'completed', 'completed_date']
+
+
+# emails of users assigned to tasks saved before emails were copied on tasks, in one batch get.
+# maps user keys to emails
+def assigned_emails(tasks):
+    assigned_users = ndb.get_multi(
+        list(set(task.assigned_user for task in tasks if task.assigned_user and not task.assigned_email)))
+    return dict((assigned_user.key, assigned_user.email) for assigned_user in assigned_users if assigned_user)
+
+
+# convert task into a row of TASK_FIELDS for export
+# emails maps user keys to emails of assigned users, from assigned_emails
+def task_row(task, emails):
+    return {
+        "title": task.title,
+        "due_date": task.due_date.strftime('%Y-%m-%d') if task.due_date else '',
+        "assigned_user": (task.assigned_email or emails.get(task.assigned_user, '')) if task.assigned_user else '',
+        "completed": '1' if task.completed else '0',
+        "completed_date": task.completed_date.strftime('%Y-%m-%d') if task.completed_date else ''
+    }
+
+
+# export tasks of taskboard as csv or newline delimited json
+# /export?id=taskboard_id&format=csv|json
+class ExportTBHandler(webapp2.RequestHandler):
+    def get(self):
+        user_object = current_user_object()
+        if user_object:
+            taskboard = ndb.Key(Taskboard, int(self.request.get('id'))).get()
+            # only creator and invited users can export
+            if has_access(user_object, taskboard):
+                export_format = 'json' if self.request.get('format') == 'json' else 'csv'
+                self.response.headers['Content-Type'] = 'text/csv' if export_format == 'csv' \
+                    else 'application/x-ndjson'
+                self.response.headers['Content-Disposition'] = 'attachment; filename="taskboard-%s.%s"' % (
+                    taskboard.key.id(), 'csv' if export_format == 'csv' else 'ndjson')
+                # csv is only needed for import and export, so not imported with module
+                import csv
+                writer = csv.DictWriter(self.response.out, TASK_FIELDS)
+                if export_format == 'csv':
+                    writer.writerow(dict(zip(TASK_FIELDS, TASK_FIELDS)))
+                # tasks are read and written page by page, so whole taskboard is never held in memory
+                cursor = None
+                more = True
+                while more:
+                    tasks, cursor, more = Task.query(Task.taskboard == taskboard.key).fetch_page(
+                        TASK_BATCH_SIZE, start_cursor=cursor)
+                    emails = assigned_emails(tasks)
+                    for task in tasks:
+                        row = task_row(task, emails)
+                        if export_format == 'csv':
+                            writer.writerow(dict((field, (value or u'').encode('utf-8'))
+                                                 for field, value in row.items()))
+                        else:
+                            self.response.write(json.dumps(row) + '\n')
+            else:
+                self.response.write("Unauthorised access!!")
+        else:
+            self.response.write("Please <a href=\"" + users.create_login_url() + "\">Login</a> to continue")
+
+
+# import tasks into taskboard from uploaded csv or newline delimited json file
+# /import, form posts id of taskboard and file
+# file is read row by row and tasks are written in batches. rows that can't be read, rows with missing title,
+# invalid dates, assignee not in taskboard or title already in taskboard are skipped
+class ImportTBHandler(webapp2.RequestHandler):
+    def post(self):
+        user_object = current_user_object()
+        if user_object:
+            taskboard = ndb.Key(Taskboard, int(self.request.get('id'))).get()
+            # only creator and invited users can import
+            if has_access(user_object, taskboard):
+                upload = self.request.POST.get('file')
+                imported = 0
+                skipped = 0
+                if hasattr(upload, 'file'):
+                    # users tasks can be assigned to, i.e creator and invited users, fetched in one batch
+                    member_keys = [taskboard.creator] + map(
+                        lambda invited_user: invited_user.user,
+                        TaskboardUser.query(TaskboardUser.taskboard == taskboard.key).fetch())
+                    members = dict((member.email, member.key) for member in ndb.get_multi(member_keys) if member)
+                    # imported tasks get taskboard title and assigned user's email copied
+                    # json if file name says so, else csv
+                    if upload.filename.lower().endswith(('.json', '.ndjson', '.jsonl')):
+                        rows = json_rows(upload.file)
+                    else:
+                        rows = csv_rows(upload.file)
+                    batch = []
+                    try:
+                        for row in rows:
+                            task = import_task(taskboard, row, members)
+                            if task:
+                                batch.append(task)
+                            else:
+                                skipped += 1
+                            # write full batch and start next one
+                            if len(batch) == TASK_BATCH_SIZE:
+                                saved = save_task_batch(batch)
+                                imported += saved
+                                skipped += len(batch) - saved
+                                batch = []
+                        # write remaining tasks
+                        saved = save_task_batch(batch)
+                        imported += saved
+                        skipped += len(batch) - saved
+                    except datastore_errors.TransactionFailedError:
+                        # taskboard kept changing by others. tasks written so far are kept,
+                        # importing the file again skips them as their titles are taken
+                        self.response.set_status(409)
+                        self.response.write("Taskboard was changed by someone else at the same time, "
+                                            "import stopped. Please go back and import the file again.")
+                        return
+                self.redirect('/viewtb?id=%s&imported=%d&skipped=%d' % (taskboard.key.id(), imported, skipped))
+            else:
+                self.response.write("Unauthorised access!!")
+        else:
+            self.response.write("Please <a href=\"" + users.create_login_url() + "\">Login</a> to continue")
+
+
+# rows of newline delimited json file, None for lines that are not a json object
+def json_rows(lines):
+    for line in lines:
+        if line.strip():
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield row if isinstance(row, dict) else None
+
+
+# rows of csv file, None for lines csv module can't read
+def csv_rows(lines):
+    # csv is only needed for import and export, so not imported with module
+    import csv
+    reader = csv.DictReader(lines)
+    while True:
+        try:
+            yield next(reader)
+        except StopIteration:
+            return
+        except csv.Error:
+            yield None
+
+
+# build task from an imported row, returns None if row is not valid
+def import_task(taskboard, row, members):
+    if not row:
+        return None
+    values = {}
+    for field in TASK_FIELDS:
+        value = row.get(field)
+        # csv values are utf-8 bytes, json values are unicode. json may also have numbers or booleans,
+        # only completed can be one of them
+        if isinstance(value, str):
+            try:
+                value = value.decode('utf-8')
+            except UnicodeDecodeError:
+                return None
+        elif field == 'completed' and isinstance(value, (bool, int, long)):
+            value = u'1' if value else u'0'
+        elif value is not None and not isinstance(value, unicode):
+            return None
+        values[field] = (value or u'').strip()
+    title = values['title']
+    assigned_user = values['assigned_user']
+    if not title or (assigned_user and assigned_user not in members):
+        return None
+    try:
+        due_date = datetime.datetime.strptime(values['due_date'], '%Y-%m-%d') if values['due_date'] else None
+        completed_date = datetime.datetime.strptime(values['completed_date'], '%Y-%m-%d') \
+            if values['completed_date'] else None
+    except ValueError:
+        return None
+    completed = values['completed'].lower() in (u'1', u'true', u'yes')
+    return Task(
+        taskboard=taskboard.key,
+        taskboard_title=taskboard.title,
+        title=title,
+        due_date=due_date,
+        assigned_user=members[assigned_user] if assigned_user else None,
+        assigned_email=assigned_user or None,
+        completed=completed,
+        completed_date=completed_date if completed else None
+    )
+
+
+# tasks written by one import transaction. each task and its title marker are entity groups of their own
+# and taskboard is one more, keeping the transaction within 25 entity groups
+IMPORT_TRANSACTION_SIZE = 12
+
+
+# save batch of new tasks with their title markers, returns number of tasks saved.
+# tasks whose title is already taken on taskboard, or repeated within batch, are not saved.
+# batch is written in transactions of IMPORT_TRANSACTION_SIZE tasks
+def save_task_batch(batch):
+    if not batch:
+        return 0
+    # new tasks get their keys first, so markers and change log can refer to them.
+    # ids can't be allocated inside a transaction
+    first_id, last_id = Task.allocate_ids(len(batch))
+    for task, task_id in zip(batch, range(first_id, last_id + 1)):
+        task.key = ndb.Key(Task, task_id)
+    saved = 0
+    for start in range(0, len(batch), IMPORT_TRANSACTION_SIZE):
+        # chunk failing because of a concurrent write to taskboard is tried again
+        saved += with_retries(save_task_chunk, batch[start:start + IMPORT_TRANSACTION_SIZE])
+    return saved
+
+
+# save tasks of one taskboard with their title markers in one transaction, returns number of tasks saved.
+# markers are checked inside the transaction, so a title saved meanwhile by save_task is never taken over,
+# and tasks are stamped with taskboard's new version in the same commit
+@ndb.transactional(xg=True)
+def save_task_chunk(tasks):
+    marker_keys = map(lambda task: task_title_key(task.taskboard, task.title), tasks)
+    # taskboard and markers in one batch get, as in write_task
+    entities = ndb.get_multi([tasks[0].taskboard] + marker_keys)
+    taskboard, markers = entities[0], entities[1:]
+    # tasks can't be added to taskboard being deleted
+    if not taskboard or taskboard.deleting:
+        return 0
+    new_tasks = []
+    new_marker_keys = []
+    for task, marker_key, marker in zip(tasks, marker_keys, markers):
+        if not marker and marker_key not in new_marker_keys:
+            new_tasks.append(task)
+            new_marker_keys.append(marker_key)
+    if not new_tasks:
+        return 0
+    record_changes(taskboard, new_tasks)
+    ndb.put_multi(new_tasks + [
+        TaskTitle(key=marker_key, taskboard=task.taskboard, task=task.key)
+        for task, marker_key in zip(new_tasks, new_marker_keys)
+    ] + [taskboard])
+    return len(new_tasks)
+
+
 # all routes
 app = webapp2.WSGIApplication([
     ('/', MainHandler),
     ('/addtb', AddTBHandler),
     ('/viewtb', ViewTBHandler),
+    ('/viewtb/changes', TBChangesHandler),
     ('/edittb', EditTBHandler),
     ('/deletetb', DeleteTBHandler),
     ('/invite', InviteToTBHandler),
-    ('/addtask', AddTaskToTBHandler)
+    ('/invite/users', InviteUserSearchHandler),
+    ('/tasks/unassign', UnassignUserHandler),
+    ('/tasks/deletetb', DeleteTBJobHandler),
+    ('/tasks/fanout', FanoutHandler),
+    ('/tasks/backfill/memberships', MembershipBackfillHandler),
+    ('/tasks/backfill/titles', TitleBackfillHandler),
+    ('/tasks/backfill/tasks', TaskFieldBackfillHandler),
+    ('/tasks/backfill/taskboards', TaskboardFieldBackfillHandler),
+    ('/tasks/duescan', DueScanHandler),
+    ('/tasks/duescan/shard', DueScanShardHandler),
+    ('/addtask', AddTaskToTBHandler),
+    ('/mytasks', MyTasksHandler),
+    ('/export', ExportTBHandler),
+    ('/import', ImportTBHandler)
 ], debug=True)
+
+# time taken by new instance to load this module
+logging.info('taskmanagement instance started in %.1f ms', (time.time() - start_time) * 1000)
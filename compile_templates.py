@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+#
+# Precompiles jinja templates of both apps into importable modules.
+# Run before deploying, compiled templates are written to templates_compiled of each app
+# and loaded by main.py with jinja2.ModuleLoader.
+# Compiled modules are python source for the python version and jinja2 version compiling them,
+# so this must run on python 2.7 with jinja2 2.6, as the App Engine python27 runtime does.
+#
+# usage: python compile_templates.py [--check] [app directory ...]
+#
+# prints time taken to load every template from source and from compiled module,
+# i.e time saved on first render of the template on a new instance.
+# with --check nothing is compiled, exits with status 1 if a compiled template is missing or
+# older than its html file
+from __future__ import print_function
+
+import hashlib
+import json
+import os
+import sys
+import time
+
+import jinja2
+
+# directory of this script
+ROOT = os.path.dirname(os.path.abspath(__file__))
+# apps with templates
+APPS = [os.path.join(ROOT, 'Activity 1'), os.path.join(ROOT, 'Activity 2', 'taskmanagement')]
+# directory of compiled templates inside app, same as in main.py
+COMPILED_DIR = 'templates_compiled'
+# sha1 of every compiled html file, to find outdated compiled templates
+MANIFEST = 'manifest.json'
+# jinja2 version of App Engine python27 runtime
+RUNTIME_JINJA2 = '2.6'
+
+
+# environment with same settings as app's main.py
+def environment(loader):
+    return jinja2.Environment(
+        loader=loader,
+        extensions=['jinja2.ext.autoescape'],
+        autoescape=True
+    )
+
+
+# milliseconds taken to load template in a fresh environment
+def load_time(loader, name):
+    start = time.time()
+    environment(loader).get_template(name)
+    return (time.time() - start) * 1000
+
+
+# html templates in app directory, not static files
+def template_names(app_dir):
+    return sorted(name for name in os.listdir(app_dir) if name.endswith('.html'))
+
+
+# sha1 of every html template of app
+def source_hashes(app_dir):
+    hashes = {}
+    for name in template_names(app_dir):
+        with open(os.path.join(app_dir, name), 'rb') as source:
+            hashes[name] = hashlib.sha1(source.read()).hexdigest()
+    return hashes
+
+
+# templates of app whose compiled module is missing or compiled from older html
+def outdated(app_dir):
+    try:
+        with open(os.path.join(app_dir, COMPILED_DIR, MANIFEST)) as manifest:
+            compiled = json.load(manifest)
+    except (IOError, ValueError):
+        compiled = {}
+    return [name for name, sha1 in sorted(source_hashes(app_dir).items()) if compiled.get(name) != sha1]
+
+
+def compile_app(app_dir):
+    target = os.path.join(app_dir, COMPILED_DIR)
+    if not os.path.isdir(target):
+        os.makedirs(target)
+    names = template_names(app_dir)
+    source_loader = jinja2.FileSystemLoader(app_dir)
+    environment(source_loader).compile_templates(target, filter_func=lambda name: name in names, zip=None)
+    with open(os.path.join(target, MANIFEST), 'w') as manifest:
+        json.dump(source_hashes(app_dir), manifest, indent=1, sort_keys=True)
+
+    print(app_dir)
+    print('  %-20s %12s %12s' % ('template', 'source ms', 'compiled ms'))
+    total_source = total_compiled = 0
+    for name in names:
+        source = load_time(source_loader, name)
+        compiled = load_time(jinja2.ModuleLoader(target), name)
+        total_source += source
+        total_compiled += compiled
+        print('  %-20s %12.2f %12.2f' % (name, source, compiled))
+    print('  %-20s %12.2f %12.2f' % ('total', total_source, total_compiled))
+
+
+if __name__ == '__main__':
+    args = sys.argv[1:]
+    check = '--check' in args
+    apps = [os.path.abspath(app) for app in args if app != '--check'] or APPS
+    if check:
+        stale = [(app, name) for app in apps for name in outdated(app)]
+        for app, name in stale:
+            print('%s: %s is not compiled or outdated' % (app, name))
+        sys.exit(1 if stale else 0)
+    # compiled modules only load on the python and jinja2 versions that made them
+    if sys.version_info[:2] != (2, 7) or jinja2.__version__ != RUNTIME_JINJA2:
+        sys.exit('templates must be compiled on python 2.7 with jinja2 %s, found python %s with jinja2 %s' % (
+            RUNTIME_JINJA2, '.'.join(map(str, sys.version_info[:3])), jinja2.__version__))
+    for app in apps:
+        compile_app(app)